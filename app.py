@@ -1,15 +1,42 @@
 import os
-import json
+import re
+import asyncio
+import contextlib
+import functools
+import hashlib
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 import google.generativeai as genai
-from flask import Flask, request, jsonify
-from flask_cors import CORS  # Import CORS for cross-origin requests
+import imagehash
+import orjson
+from cachetools import TTLCache
+from quart import Quart, Response, request, jsonify
+from quart.json.provider import DefaultJSONProvider
+from quart_cors import cors  # Import CORS for cross-origin requests
+from redis import asyncio as aioredis
+from redis.exceptions import RedisError
 from PIL import Image
 import io
 
 # --- Initialization ---
-app = Flask(__name__)
+# Quart is the asyncio (ASGI) port of Flask, so in-flight Gemini calls don't pin a worker thread.
+# Serve with: gunicorn app:app (settings live in gunicorn.conf.py)
+app = Quart(__name__)
+
+class ORJSONProvider(DefaultJSONProvider):
+    """JSON provider backed by orjson, used by jsonify() and request.get_json()."""
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+app.json = ORJSONProvider(app)
+
 # Enable CORS to allow your Netlify frontend to call this backend
-CORS(app)
+app = cors(app)
 
 # --- Configure the Gemini API ---
 # It's crucial to set your API key as an environment variable for security
@@ -20,17 +47,116 @@ try:
     api_key = os.environ.get("GEMINI_API_KEY")
     if not api_key:
         raise ValueError("GEMINI_API_KEY environment variable not set.")
-    genai.configure(api_key=api_key)
 except (ValueError, KeyError) as e:
     print(f"CRITICAL ERROR: {e}")
     # In a real app, you might exit or handle this more gracefully
     # For now, we'll let it run but endpoints will fail.
 
-# --- AI Model Initialization ---
-# Initialize the models you'll be using
-# Using gemini-1.5-flash-latest for both vision and text.
-model = genai.GenerativeModel('gemini-1.5-flash-latest')
+@functools.lru_cache(maxsize=1)
+def get_genai():
+    """Configure the Gemini SDK on first use.
+
+    The SDK itself is imported at module level so that Gunicorn's preload pays for it once in the
+    master; only configuration and client creation wait until a worker is serving requests.
+    """
+    genai.configure(api_key=api_key)
+    return genai
+
+# --- Supported Diseases ---
+# Common diseases of each supported plant. Names found here are served in their canonical spelling
+# and cached. The analyzer isn't bound to this table, so other names sent by clients are still
+# answered, but they are not cached and only a few may be generated at once (see
+# resolve_treatment_request).
+KNOWN_DISEASES = {
+    "Apple": ("Apple Scab", "Black Rot", "Cedar Apple Rust", "Fire Blight", "Powdery Mildew"),
+    "Banana": ("Black Sigatoka", "Panama Disease", "Banana Bunchy Top"),
+    "Cherry": ("Powdery Mildew", "Cherry Leaf Spot"),
+    "Corn": ("Gray Leaf Spot", "Common Rust", "Southern Rust", "Northern Leaf Blight"),
+    "Grape": ("Black Rot", "Esca (Black Measles)", "Leaf Blight", "Downy Mildew", "Powdery Mildew"),
+    "Orange": ("Citrus Greening", "Citrus Canker"),
+    "Peach": ("Bacterial Spot", "Peach Leaf Curl"),
+    "Pepper": ("Bacterial Spot", "Phytophthora Blight"),
+    "Potato": ("Early Blight", "Late Blight"),
+    "Raspberry": ("Anthracnose", "Cane Blight"),
+    "Soybean": ("Soybean Rust", "Frogeye Leaf Spot"),
+    "Squash": ("Powdery Mildew", "Downy Mildew", "Squash Mosaic Virus"),
+    "Strawberry": ("Leaf Scorch", "Leaf Spot"),
+    "Tomato": (
+        "Bacterial Spot", "Early Blight", "Late Blight", "Leaf Mold", "Septoria Leaf Spot",
+        "Spider Mites", "Target Spot", "Tomato Yellow Leaf Curl Virus", "Tomato Mosaic Virus",
+    ),
+}
+
+def _normalize_name(name):
+    """Lowercase a name and collapse its whitespace, for case-insensitive lookups."""
+    return " ".join(name.lower().split())
+
+# Normalized (plant, disease) -> canonical (plant, disease), plus an index by disease alone
+_KNOWN_PAIRS = {
+    (_normalize_name(plant), _normalize_name(disease)): (plant, disease)
+    for plant, diseases in KNOWN_DISEASES.items()
+    for disease in diseases
+}
+_PAIRS_BY_DISEASE = {}
+for _pair in _KNOWN_PAIRS:
+    _PAIRS_BY_DISEASE.setdefault(_pair[1], []).append(_pair)
+_KNOWN_PLANTS = tuple(_normalize_name(plant) for plant in KNOWN_DISEASES)
+
+def lookup_disease(disease_name, plant=None):
+    """Resolve a disease to its canonical (plant, disease) pair in KNOWN_DISEASES, or None.
+
+    Accepts a bare disease name when only one plant has it ("Apple Scab", "Soybean Rust"), the web
+    client's "<plant> <disease>" form ("Grape Black Rot"), or a separate plant, in which case a
+    repeated plant prefix ("Grape" + "Grape Black Rot") is ignored.
+    """
+    name = _normalize_name(disease_name)
+    if plant:
+        plant = _normalize_name(plant)
+        candidates = [(plant, name)]
+        if name.startswith(plant + " "):
+            candidates.append((plant, name[len(plant) + 1:]))
+    else:
+        candidates = list(_PAIRS_BY_DISEASE.get(name, ()))
+        candidates += [(p, name[len(p) + 1:]) for p in _KNOWN_PLANTS if name.startswith(p + " ")]
+
+    matches = {_KNOWN_PAIRS[pair] for pair in candidates if pair in _KNOWN_PAIRS}
+    # Several matches means the name is ambiguous, e.g. "Black Rot" on both Apple and Grape
+    return matches.pop() if len(matches) == 1 else None
+
+# Plant and disease names from clients longer than this are rejected outright
+MAX_NAME_LENGTH = 100
 
+def resolve_treatment_request(disease_name, plant=None):
+    """Turn a client's disease (and optional plant) into the (plant, disease, trusted) to generate.
+
+    Returns None for malformed input. Names in KNOWN_DISEASES resolve to their canonical spelling
+    and are trusted; anything else is passed through as given, untrusted.
+    """
+    def is_valid(name):
+        return isinstance(name, str) and 0 < len(name.strip()) <= MAX_NAME_LENGTH
+
+    if not is_valid(disease_name) or (plant is not None and not is_valid(plant)):
+        return None
+
+    known = lookup_disease(disease_name, plant)
+    if known is not None:
+        return known[0], known[1], True
+    return (plant or '').strip(), disease_name.strip(), False
+
+# Sent instead of a generated plan when the diagnosis has nothing to treat
+NO_TREATMENT_NEEDED = "No treatment is needed: the plant is healthy or isn't supported by this service."
+
+def needs_treatment(plant, disease):
+    """Tell whether a diagnosis has anything to treat, using the same rules as the web client.
+
+    Healthy leaves, unsupported plants and the analyzer's "N/A" placeholder never get a plan.
+    Comparisons ignore case, since the analyzer doesn't always match the prompt's capitalization.
+    """
+    if not isinstance(disease, str) or not isinstance(plant, (str, type(None))):
+        return False
+    if plant is not None and _normalize_name(plant) == 'unsupported plant':
+        return False
+    return _normalize_name(disease) not in ('', 'healthy', 'n/a')
 
 # --- Prompts for the AI ---
 # A detailed prompt for image analysis to ensure structured JSON output
@@ -51,9 +177,9 @@ Provide your response ONLY in a valid JSON format with the following keys:
 Do not include any other text or explanations outside of the JSON object.
 """
 
-# A prompt for generating a treatment plan
-treatment_plan_prompt_template = """
-You are an agricultural advisor. A farmer has identified "{disease_name}" on their plant.
+# The static part of the treatment plan prompt, shared by every request
+treatment_plan_system_prompt = """
+You are an agricultural advisor. A farmer will tell you which disease they have identified on their plant.
 Generate a concise, actionable treatment plan. Structure the plan with the following sections:
 1.  **Immediate Actions:** What to do right now (e.g., pruning, isolating plants).
 2.  **Organic Solutions:** Safe, organic treatment options.
@@ -63,57 +189,529 @@ Generate a concise, actionable treatment plan. Structure the plan with the follo
 Keep the language clear and easy for a non-expert to understand.
 """
 
+# The per-request part of the treatment plan prompt
+treatment_plan_prompt_template = """A farmer has identified "{disease}" on their {plant}."""
+
+@functools.lru_cache(maxsize=512)
+def format_treatment_prompt(plant, disease):
+    """Fill in the treatment plan prompt; the same disease always yields the same (shared) string."""
+    return treatment_plan_prompt_template.format(plant=f"{plant} plant" if plant else "plant", disease=disease)
+
+# --- AI Model Initialization ---
+# Models are built on first use and then reused for the life of the process.
+# Using gemini-1.5-flash-latest for both vision and text.
+# The static prompts are attached once as system instructions instead of being rebuilt into every request.
+@functools.lru_cache(maxsize=1)
+def get_vision_model():
+    """Return the model used for image analysis."""
+    return get_genai().GenerativeModel('gemini-1.5-flash-latest', system_instruction=image_analysis_prompt)
+
+@functools.lru_cache(maxsize=1)
+def get_treatment_model():
+    """Return the model used for treatment plans."""
+    return get_genai().GenerativeModel('gemini-1.5-flash-latest', system_instruction=treatment_plan_system_prompt)
+
+# --- Caching ---
+# Bump CACHE_VERSION whenever a prompt changes so stale cached responses are invalidated.
+CACHE_VERSION = "v4"
+
+# Redis is shared by every worker. A short timeout keeps requests moving when it is unreachable.
+REDIS_URL = os.environ.get("REDIS_URL", "redis://localhost:6379/0")
+REDIS_TIMEOUT = 1.0
+
+@functools.lru_cache(maxsize=1)
+def get_redis():
+    """Return the Redis client, created on first use so its connections are opened inside the worker."""
+    return aioredis.from_url(REDIS_URL, socket_connect_timeout=REDIS_TIMEOUT, socket_timeout=REDIS_TIMEOUT)
+
+async def shared_cache_get(local_cache, key):
+    """Read a cached value (bytes) from Redis, or from local_cache if Redis is unavailable."""
+    try:
+        return await get_redis().get(key)
+    except RedisError as e:
+        print(f"Redis unavailable, reading {key} from the local cache: {e}")
+        return local_cache.get(key)
+
+async def shared_cache_set(local_cache, key, value, ttl):
+    """Store a value (bytes) in Redis with SETEX, keeping a local_cache copy for when Redis is down."""
+    local_cache[key] = value
+    try:
+        await get_redis().setex(key, ttl, value)
+    except RedisError as e:
+        print(f"Redis unavailable, {key} is only cached locally: {e}")
+
+# Disease names come from a small closed set, so treatment plans are cached for a day: in Redis, so
+# every worker serves the same plan, and in a per-process TTLCache used while Redis is unreachable.
+TREATMENT_PLAN_TTL = 86400
+treatment_plan_cache = TTLCache(maxsize=256, ttl=TREATMENT_PLAN_TTL)
+
+async def get_cached_treatment_plan(cache_key):
+    """Return the cached treatment plan text for a cache key, or None."""
+    plan = await shared_cache_get(treatment_plan_cache, cache_key)
+    return None if plan is None else plan.decode()
+
+def treatment_cache_key(plant, disease):
+    """Build the cache key for a plant's disease, normalized so casing and whitespace don't matter."""
+    return f"{CACHE_VERSION}-treatment:{_normalize_name(plant)}:{_normalize_name(disease)}"
+
+# Clients may reuse a treatment plan response for an hour without asking again.
+TREATMENT_PLAN_MAX_AGE = 3600
+
+def treatment_plan_etag(plant, disease):
+    """Build the ETag for a disease's treatment plan; like the cache key, it changes with CACHE_VERSION."""
+    return hashlib.sha1(treatment_cache_key(plant, disease).encode()).hexdigest()
+
+def set_treatment_plan_cache_headers(response, etag):
+    """Let browsers and CDNs cache a treatment plan response and revalidate it by ETag.
+
+    The ETag is weak because the plan behind it is regenerated whenever its cache entry expires
+    (and per worker while Redis is down), so the text is equivalent rather than byte-for-byte
+    identical.
+    """
+    response.set_etag(etag, weak=True)
+    response.cache_control.public = True
+    response.cache_control.max_age = TREATMENT_PLAN_MAX_AGE
+
+# Analyses are cached for a week by perceptual hash, so re-uploads of the same leaf skip Gemini.
+# Like treatment plans, they live in Redis with a per-process fallback.
+IMAGE_ANALYSIS_TTL = 7 * 86400
+image_analysis_cache = TTLCache(maxsize=1024, ttl=IMAGE_ANALYSIS_TTL)
+
+def analysis_cache_key(img):
+    """Build the cache key for an image from its perceptual hash."""
+    return f"{CACHE_VERSION}-analysis:{imagehash.phash(img)}"
+
+# Background analyses started by /analyze-image-async are tracked in Redis, so a poll can be answered
+# by any worker, not just the one that accepted the upload. Jobs are kept for an hour so the client
+# has time to collect the result.
+ANALYSIS_JOB_TTL = 3600
+
+# A job runs only on the worker that accepted it. If that worker dies (timeout, OOM, deploy) nothing
+# ever completes the job, so a job still pending after this long is reported as failed. It matches
+# Gunicorn's worker timeout, and the job itself is cancelled at the same bound.
+ANALYSIS_JOB_TIMEOUT = 120
+
+def analysis_job_key(token):
+    """Build the Redis key holding the state of a background analysis."""
+    return f"analysis-job:{token}"
+
+# --- Image Preprocessing ---
+# Gemini downsamples uploads internally, so anything larger than this only costs upload time.
+MAX_IMAGE_EDGE = 768
+JPEG_QUALITY = 85
+
+# PIL work is CPU-bound, so it runs on a dedicated, bounded pool instead of the event loop or
+# asyncio's shared default executor.
+EXECUTOR_MAX_WORKERS = (os.cpu_count() or 1) * 2
+image_executor = ThreadPoolExecutor(max_workers=EXECUTOR_MAX_WORKERS, thread_name_prefix='image')
+
+async def run_in_image_executor(func, *args):
+    """Run a blocking image function on image_executor and await its result."""
+    return await asyncio.get_running_loop().run_in_executor(image_executor, func, *args)
+
+def prepare_image(file_bytes):
+    """Decode an uploaded image, shrink it to MAX_IMAGE_EDGE and re-encode it as a compact JPEG."""
+    img = Image.open(io.BytesIO(file_bytes))
+    img.thumbnail((MAX_IMAGE_EDGE, MAX_IMAGE_EDGE), Image.LANCZOS)
+
+    buf = io.BytesIO()
+    img.convert('RGB').save(buf, 'JPEG', quality=JPEG_QUALITY, optimize=True)
+    buf.seek(0)
+    img = Image.open(buf)
+    # Force the decode now so it happens on the calling (worker) thread rather than the event loop
+    img.load()
+    return img
+
+# --- Gemini Helpers ---
+
+# Gemini sometimes wraps its JSON in markdown fences; grab the outermost object instead.
+_JSON_RE = re.compile(r'\{.*\}', re.S)
+
+# Image analyses currently running, keyed by their cache key. Concurrent requests for the same image
+# await the call that is already in flight instead of starting their own.
+_inflight = {}
+
+async def single_flight(key, func):
+    """Await func() for this key, sharing one in-flight call between all concurrent callers."""
+    task = _inflight.get(key)
+    if task is None:
+        task = asyncio.ensure_future(func())
+        _inflight[key] = task
+        task.add_done_callback(lambda _: _inflight.pop(key, None))
+    # Shield the shared call so one caller disconnecting doesn't cancel it for everyone else
+    return await asyncio.shield(task)
+
+async def request_analysis(img, cache_key):
+    """Call Gemini to analyze an image and store the parsed result in the analysis cache."""
+    # Call the Gemini API using the updated model
+    response = await get_vision_model().generate_content_async(img)
+
+    # Extract the JSON object from the response
+    match = _JSON_RE.search(response.text)
+    if not match:
+        raise ValueError("Gemini response did not contain a JSON object")
+    result = orjson.loads(match.group(0))
+    await shared_cache_set(image_analysis_cache, cache_key, orjson.dumps(result), IMAGE_ANALYSIS_TTL)
+    return result
+
+async def analyze_image(img):
+    """Run the image analysis prompt against a PIL image and return the parsed JSON result."""
+    # Hashing is CPU-bound, so keep it off the event loop
+    cache_key = await run_in_image_executor(analysis_cache_key, img)
+    cached_result = await shared_cache_get(image_analysis_cache, cache_key)
+    if cached_result is not None:
+        return orjson.loads(cached_result)
+
+    result = await single_flight(cache_key, functools.partial(request_analysis, img, cache_key))
+
+    # Hand out a copy so callers can add fields without touching the shared result
+    return dict(result)
+
+class PlanStream:
+    """A treatment plan being generated, shared by every request for the same disease.
+
+    Chunks are kept as they arrive, so a request that joins late replays what it missed and then
+    follows along. `task` resolves to the full plan text once generation is done.
+    """
+
+    def __init__(self):
+        self.chunks = []
+        self.finished = False
+        self.task = None
+        self._changed = asyncio.Condition()
+
+    async def publish(self, text):
+        async with self._changed:
+            self.chunks.append(text)
+            self._changed.notify_all()
+
+    async def finish(self):
+        async with self._changed:
+            self.finished = True
+            self._changed.notify_all()
+
+    async def follow(self):
+        """Yield every chunk of the plan, starting from the first, until generation finishes."""
+        sent = 0
+        while True:
+            async with self._changed:
+                await self._changed.wait_for(lambda: len(self.chunks) > sent or self.finished)
+                new_chunks = self.chunks[sent:]
+                finished = self.finished
+            for text in new_chunks:
+                yield text
+            sent += len(new_chunks)
+            if finished:
+                return
+
+# Treatment plans currently being generated, keyed by their cache key. Plain and streaming requests
+# for the same disease all attach to the one in-flight Gemini call.
+_plan_streams = {}
+
+# Plans for untrusted names (not in KNOWN_DISEASES and not from the analyzer) are never cached, so
+# each one costs a Gemini call; cap how many run at once per worker so junk names can't run up cost.
+UNTRUSTED_PLAN_CONCURRENCY = 2
+untrusted_plan_semaphore = asyncio.Semaphore(UNTRUSTED_PLAN_CONCURRENCY)
+
+async def request_treatment_plan(plant, disease, cache_key, stream, trusted):
+    """Stream a treatment plan from Gemini into a PlanStream, caching the full plan if trusted."""
+    try:
+        async with contextlib.nullcontext() if trusted else untrusted_plan_semaphore:
+            # Format the prompt with the specific plant and disease
+            prompt = format_treatment_prompt(plant, disease)
+
+            # Call the Gemini API using the updated model
+            response = await get_treatment_model().generate_content_async(prompt, stream=True)
+            async for chunk in response:
+                await stream.publish(chunk.text)
+    finally:
+        # Wake every follower whether or not generation succeeded; errors surface through the task
+        await stream.finish()
+
+    plan = ''.join(stream.chunks)
+    if trusted:
+        await shared_cache_set(treatment_plan_cache, cache_key, plan.encode(), TREATMENT_PLAN_TTL)
+    return plan
+
+def get_plan_stream(plant, disease, cache_key, trusted):
+    """Return the in-flight PlanStream for this disease, starting the Gemini call if there is none."""
+    stream = _plan_streams.get(cache_key)
+    if stream is None:
+        stream = PlanStream()
+        stream.task = asyncio.ensure_future(
+            request_treatment_plan(plant, disease, cache_key, stream, trusted)
+        )
+        _plan_streams[cache_key] = stream
+        stream.task.add_done_callback(lambda _: _plan_streams.pop(cache_key, None))
+    return stream
+
+async def generate_treatment_plan(plant, disease, trusted=True):
+    """Generate a treatment plan for a disease on the given plant and return it as text.
+
+    Only trusted names (canonical KNOWN_DISEASES pairs or the analyzer's own diagnoses) are written
+    to the cache; see resolve_treatment_request.
+    """
+    cache_key = treatment_cache_key(plant, disease)
+    cached_plan = await get_cached_treatment_plan(cache_key)
+    if cached_plan is not None:
+        return cached_plan
+
+    # Shield the shared call so one caller disconnecting doesn't cancel it for everyone else
+    return await asyncio.shield(get_plan_stream(plant, disease, cache_key, trusted).task)
+
+async def stream_treatment_plan(plant, disease, trusted=True):
+    """Generate a treatment plan like generate_treatment_plan, yielding chunks as Gemini produces them."""
+    cache_key = treatment_cache_key(plant, disease)
+    cached_plan = await get_cached_treatment_plan(cache_key)
+    if cached_plan is not None:
+        yield cached_plan
+        return
+
+    stream = get_plan_stream(plant, disease, cache_key, trusted)
+    async for text in stream.follow():
+        yield text
+
+    # Re-raise a failed generation so the endpoint can report it
+    await asyncio.shield(stream.task)
+
+async def analyze_upload(file_bytes):
+    """Decode, preprocess and analyze the bytes of a single uploaded file."""
+    img = await run_in_image_executor(prepare_image, file_bytes)
+    return await analyze_image(img)
+
+async def run_analysis_job(token, file_bytes):
+    """Analyze an upload in the background and record the outcome under the job's token."""
+    try:
+        result = await asyncio.wait_for(analyze_upload(file_bytes), ANALYSIS_JOB_TIMEOUT)
+        state = {"status": "done", "result": result}
+    except asyncio.TimeoutError:
+        print(f"Analysis job {token} timed out")
+        state = {"status": "error", "error": "The analysis took too long. Please try again."}
+    except Exception as e:
+        print(f"Error in analysis job {token}: {e}")
+        state = {"status": "error", "error": f"An error occurred during analysis: {str(e)}"}
+
+    try:
+        await get_redis().set(analysis_job_key(token), orjson.dumps(state), ex=ANALYSIS_JOB_TTL)
+    except Exception as e:
+        print(f"Error storing analysis job {token}: {e}")
+
 # --- API Endpoints ---
 
 @app.route('/analyze-image', methods=['POST'])
-def analyze_image_endpoint():
+async def analyze_image_endpoint():
     """Endpoint to receive an image and return a Gemini Vision analysis."""
-    if 'file' not in request.files:
+    files = await request.files
+    if 'file' not in files:
         return jsonify({"error": "No file part"}), 400
 
-    file = request.files['file']
+    file = files['file']
     if file.filename == '':
         return jsonify({"error": "No selected file"}), 400
 
     try:
-        img = Image.open(file.stream)
-        
-        # Call the Gemini API using the updated model
-        response = model.generate_content([image_analysis_prompt, img])
-        
-        # Clean the response to ensure it's valid JSON
-        json_text = response.text.strip().replace('```json', '').replace('```', '')
-        result = json.loads(json_text)
-        
+        result = await analyze_upload(file.read())
         return jsonify(result)
 
     except Exception as e:
         print(f"Error in /analyze-image: {e}")
         return jsonify({"error": f"An error occurred during analysis: {str(e)}"}), 500
 
-@app.route('/get-treatment-plan', methods=['POST'])
-def get_treatment_plan_endpoint():
-    """Endpoint to receive a disease name and return a generated treatment plan."""
-    data = request.get_json()
+@app.route('/analyze-image-async', methods=['POST'])
+async def analyze_image_async_endpoint():
+    """Endpoint to start an image analysis in the background and return a token right away.
+
+    The client polls /result/<token> (backing off between attempts) until the analysis is ready,
+    so the connection isn't held open for the whole Gemini round-trip.
+    """
+    files = await request.files
+    if 'file' not in files:
+        return jsonify({"error": "No file part"}), 400
+
+    file = files['file']
+    if file.filename == '':
+        return jsonify({"error": "No selected file"}), 400
+
+    try:
+        # Read the upload now; the request's file objects are released once the response is sent
+        file_bytes = file.read()
+        token = uuid.uuid4().hex
+        pending = orjson.dumps({"status": "pending", "started": time.time()})
+        await get_redis().set(analysis_job_key(token), pending, ex=ANALYSIS_JOB_TTL)
+
+        # Quart holds a reference to background tasks until they finish and waits for them on shutdown
+        app.add_background_task(run_analysis_job, token, file_bytes)
+        return jsonify({"token": token}), 202
+
+    except Exception as e:
+        print(f"Error in /analyze-image-async: {e}")
+        return jsonify({"error": f"An error occurred while starting the analysis: {str(e)}"}), 500
+
+@app.route('/result/<token>', methods=['GET'])
+async def result_endpoint(token):
+    """Endpoint to poll for the result of an analysis started with /analyze-image-async."""
+    try:
+        state = await get_redis().get(analysis_job_key(token))
+    except Exception as e:
+        print(f"Error in /result/{token}: {e}")
+        return jsonify({"error": f"An error occurred while fetching the result: {str(e)}"}), 500
+
+    if state is None:
+        return jsonify({"error": "Unknown or expired token"}), 404
+
+    state = orjson.loads(state)
+    if state["status"] == "pending":
+        if time.time() - state["started"] <= ANALYSIS_JOB_TIMEOUT:
+            return jsonify({"status": "pending"}), 202
+        # The worker running the job is gone, so it will never finish
+        return jsonify({"error": "The analysis did not finish. Please upload the image again."}), 500
+    if state["status"] == "error":
+        return jsonify({"error": state["error"]}), 500
+    return jsonify(state["result"])
+
+@app.route('/get-treatment-plan', methods=['GET', 'POST'])
+async def get_treatment_plan_endpoint():
+    """Endpoint to receive a disease name and return a generated treatment plan.
+
+    The plant is optional, given either as a separate 'plant' field or as a prefix of
+    'disease_name' (e.g. "Grape Black Rot"), in the JSON body for POST or as query parameters for
+    GET. GET responses for KNOWN_DISEASES carry an ETag and Cache-Control so browsers and CDNs can
+    cache them.
+    """
+    if request.method == 'GET':
+        data = request.args
+    else:
+        data = await request.get_json()
     if not data or 'disease_name' not in data:
-        return jsonify({"error": "Missing 'disease_name' in request body"}), 400
+        return jsonify({"error": "Missing 'disease_name' in request"}), 400
+
+    resolved = resolve_treatment_request(data['disease_name'], data.get('plant'))
+    if resolved is None:
+        return jsonify({"error": "Invalid 'disease_name' or 'plant'"}), 400
+    plant, disease, trusted = resolved
+    if not needs_treatment(plant, disease):
+        return jsonify({"plan": NO_TREATMENT_NEEDED})
+
+    # Only cached plans requested over GET are cacheable downstream; a GET client that already
+    # holds this plan gets an empty 304
+    cacheable = trusted and request.method == 'GET'
+    etag = treatment_plan_etag(plant, disease)
+    if cacheable and request.if_none_match.contains_weak(etag):
+        response = Response(status=304)
+        set_treatment_plan_cache_headers(response, etag)
+        return response
 
-    disease_name = data['disease_name']
-    
     try:
-        # Format the prompt with the specific disease name
-        prompt = treatment_plan_prompt_template.format(disease_name=disease_name)
-        
-        # Call the Gemini API using the updated model
-        response = model.generate_content(prompt)
-        
-        return jsonify({"plan": response.text})
+        plan = await generate_treatment_plan(plant, disease, trusted)
+        response = jsonify({"plan": plan})
+        if cacheable:
+            set_treatment_plan_cache_headers(response, etag)
+        return response
 
     except Exception as e:
         print(f"Error in /get-treatment-plan: {e}")
         return jsonify({"error": f"An error occurred while generating the plan: {str(e)}"}), 500
 
-# --- Main execution ---
-if __name__ == '__main__':
-    # The server will run on http://127.0.0.1:5000 by default
-    app.run(debug=True, port=5000)
+@app.route('/stream-treatment-plan', methods=['GET'])
+async def stream_treatment_plan_endpoint():
+    """Endpoint to stream a treatment plan as Server-Sent Events while it is being generated.
+
+    Takes the disease name (and optionally the plant, as for /get-treatment-plan) as query
+    parameters so it can be consumed with a browser EventSource. Each chunk is sent as a
+    JSON-encoded string in a 'data' event, followed by a final 'done' event.
+    """
+    disease_name = request.args.get('disease_name')
+    if not disease_name:
+        return jsonify({"error": "Missing 'disease_name' query parameter"}), 400
+    resolved = resolve_treatment_request(disease_name, request.args.get('plant'))
+    if resolved is None:
+        return jsonify({"error": "Invalid 'disease_name' or 'plant'"}), 400
+    plant, disease, trusted = resolved
+
+    async def events():
+        try:
+            if not needs_treatment(plant, disease):
+                yield f"data: {app.json.dumps(NO_TREATMENT_NEEDED)}\n\n"
+            else:
+                async for text in stream_treatment_plan(plant, disease, trusted):
+                    yield f"data: {app.json.dumps(text)}\n\n"
+            yield "event: done\ndata: {}\n\n"
+        except Exception as e:
+            print(f"Error in /stream-treatment-plan: {e}")
+            error = {"error": f"An error occurred while generating the plan: {str(e)}"}
+            yield f"event: error\ndata: {app.json.dumps(error)}\n\n"
+
+    response = Response(events(), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    # Generation can outlast Quart's default response timeout
+    response.timeout = None
+    return response
+
+@app.route('/analyze-and-treat', methods=['POST'])
+async def analyze_and_treat_endpoint():
+    """Endpoint to analyze an image and return the diagnosis together with its treatment plan.
+
+    Saves the client a second round-trip to /get-treatment-plan: the plan is requested as soon
+    as the disease is known, in the same request.
+    """
+    files = await request.files
+    if 'file' not in files:
+        return jsonify({"error": "No file part"}), 400
+
+    file = files['file']
+    if file.filename == '':
+        return jsonify({"error": "No selected file"}), 400
+
+    try:
+        result = await analyze_upload(file.read())
+
+        # Healthy leaves and unsupported plants have nothing to treat, so skip the plan call
+        plant, disease = result.get('plant'), result.get('disease')
+        if needs_treatment(plant, disease):
+            # The plant matters too, since e.g. Black Rot differs on Apple and Grape. Use the canonical
+            # spelling when the diagnosis is in KNOWN_DISEASES, otherwise trust the analyzer's names.
+            plant, disease = lookup_disease(disease, plant) or (plant, disease)
+            result['plan'] = await generate_treatment_plan(plant, disease)
+        else:
+            result['plan'] = None
+
+        return jsonify(result)
+
+    except Exception as e:
+        print(f"Error in /analyze-and-treat: {e}")
+        return jsonify({"error": f"An error occurred during analysis: {str(e)}"}), 500
+
+# Caps how many Gemini calls /analyze-batch keeps in flight at once, to stay within rate limits
+BATCH_CONCURRENCY = 8
+batch_semaphore = asyncio.Semaphore(BATCH_CONCURRENCY)
+
+# Largest batch accepted in one request, so a single client can't hold every semaphore slot for long
+MAX_BATCH_FILES = 10
+
+@app.route('/analyze-batch', methods=['POST'])
+async def analyze_batch_endpoint():
+    """Endpoint to analyze several images in one request.
+
+    The files are analyzed concurrently and the results are returned in upload order; a file that
+    fails gets an "error" entry instead of failing the whole batch.
+    """
+    files = (await request.files).getlist('file')
+    files = [file for file in files if file.filename != '']
+    if not files:
+        return jsonify({"error": "No file part"}), 400
+    if len(files) > MAX_BATCH_FILES:
+        return jsonify({"error": f"Too many files: at most {MAX_BATCH_FILES} per batch"}), 400
+
+    async def analyze_one(file):
+        async with batch_semaphore:
+            return await analyze_upload(file.read())
+
+    results = await asyncio.gather(*(analyze_one(file) for file in files), return_exceptions=True)
+
+    response = []
+    for file, result in zip(files, results):
+        if isinstance(result, Exception):
+            print(f"Error in /analyze-batch for {file.filename}: {result}")
+            result = {"error": f"An error occurred during analysis: {str(result)}"}
+        response.append(result)
+    return jsonify(response)
@@ -0,0 +1,19 @@
+# Gunicorn settings, picked up automatically by: gunicorn app:app
+import os
+
+# Bind to the port provided by the host (Render, Heroku, ...) or 5000 locally
+bind = f"0.0.0.0:{os.environ.get('PORT', '5000')}"
+
+# Quart is an ASGI app, so run it on uvicorn's asyncio workers. Each worker multiplexes
+# many in-flight Gemini calls on its event loop instead of blocking on one at a time.
+worker_class = "uvicorn.workers.UvicornWorker"
+workers = int(os.environ.get("WEB_CONCURRENCY", 4))
+
+# Gemini calls can take several seconds; leave headroom before a worker is considered stuck
+timeout = 120
+
+# Import the app once in the master before forking, so the prompts, disease list and other
+# module-level constants (and the Gemini SDK import) are paid for once and shared copy-on-write
+# by every worker. The SDK's client and gRPC channel are created lazily, after the fork, so
+# nothing forked is bound to the parent process.
+preload_app = True